@@ -1,16 +1,23 @@
 import os
-import json
-from typing import Optional, get_args
+import threading
+from contextlib import asynccontextmanager
+from typing import Literal, Optional, get_args
 
-from fastapi import FastAPI, HTTPException, Security, Depends
+from fastapi import FastAPI, HTTPException, Security, Depends, Header, Query, Response
 from fastapi.security import APIKeyHeader
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, Field, model_validator
 from dotenv import load_dotenv
 
 from schemas.youtube_attributes import genreSchema, moodSchema, instrumentSchema, licenseTypeSchema
-from utils.track_downloader import get_download_url_for_track, stream_track_from_url
+from utils.track_downloader import get_download_url_for_track, open_track_stream
+from utils.upstream_guard import UpstreamUnavailable, studio_guard, media_guard
 from utils.playlist_scraper import get_all_tracks as get_all_tracks_from_youtube
+from utils import json_backend
+from utils.compact_tracks import CompactTrack, GENRES, MOODS, INSTRUMENTS, LICENSES, join_tracks
+from utils.similarity import SimilarityIndex
+from utils.search_cache import SearchCache, normalize_search_key, make_etag, etag_matches
+from utils.popularity import Prefetcher
 
 load_dotenv()
 
@@ -34,9 +41,19 @@ attributes = {
     "instruments": get_args(instrumentSchema)
 }
 
+# Tracks download popularity and keeps URLs (and optionally audio) warm for hot tracks
+prefetcher = Prefetcher(prefetch_audio=os.getenv("PREFETCH_AUDIO", "false").lower() == "true")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prefetcher.start()
+    yield
+    prefetcher.stop()
+
 app = FastAPI(
     title="YouTube Creator Music API",
-    description="A custom microservice to filter and download royalty-free music."
+    description="A custom microservice to filter and download royalty-free music.",
+    lifespan=lifespan
 )
 
 class Attribute(BaseModel):
@@ -58,21 +75,109 @@ class TrackSearchRequest(BaseModel):
     license_type: Optional[licenseTypeSchema] = 'CREATOR_MUSIC_LICENSE_TYPE_CCBY_4'
     use_or_logic: Optional[bool] = False
 
-def load_tracks_from_db():
-    """Helper function to load our track data."""
-    global attributes
+class SimilarTracksRequest(BaseModel):
+    track_ids: list[str] = Field(min_length=1)
+    k: int = Field(default=10, ge=1, le=100)
+    metric: Literal['jaccard', 'cosine'] = 'jaccard'
+    license_type: Optional[licenseTypeSchema] = None
+
+TRACKS_DB_FILE = "youtube_studio_tracks.json"
+
+# In-memory copy of the track database as CompactTrack records plus the
+# attribute matrix used for similarity queries, reloaded only when the file changes.
+catalog = {"version": None, "tracks": [], "similarity": SimilarityIndex([])}
+catalog_lock = threading.Lock()
+search_cache = SearchCache()
+
+def catalog_version(stat: os.stat_result):
+    """
+    Identifies one version of the track database file. The inode changes
+    on every atomic replace, even within the same mtime tick and size.
+    """
+    return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def get_catalog_version():
+    return catalog_version(os.stat(TRACKS_DB_FILE))
+
+def load_catalog():
+    """
+    Returns the in-memory catalog, re-reading the track database only
+    when its version has changed. The catalog dict is replaced as a whole,
+    so callers always see tracks and version that belong together.
+    """
+    global attributes, catalog
     try:
-        if not os.path.exists("youtube_studio_tracks.json"):
+        if not os.path.exists(TRACKS_DB_FILE):
             result = get_all_tracks_from_youtube()
-            attributes = result.get("available_attributes", {})
-        with open("youtube_studio_tracks.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data.get("tracks", [])
+            if not result.get("error"):
+                attributes = result.get("available_attributes", {})
+        version = get_catalog_version()
+        if catalog["version"] == version:
+            return catalog
+        with catalog_lock, open(TRACKS_DB_FILE, "rb") as f:
+            # Version the contents from the handle actually read, so a replace
+            # between the stat above and this read can't be cached under the old version
+            read_version = catalog_version(os.fstat(f.fileno()))
+            if catalog["version"] != read_version:
+                data = json_backend.loads(f.read())
+                tracks = [CompactTrack.from_dict(track) for track in data.get("tracks", [])]
+                del data
+                catalog = {"version": read_version, "tracks": tracks, "similarity": SimilarityIndex(tracks)}
+            return catalog
     except FileNotFoundError:
         raise HTTPException(status_code=500, detail="Track database file not found.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading track database: {e}")
 
+def json_response(body: bytes, headers: Optional[dict] = None):
+    """Wraps an already-encoded JSON body without re-serializing it."""
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def track_file_extension(download_url: str):
+    """Guesses the audio file extension from the download URL."""
+    file_extension = "mp3" # Default to mp3
+    if ".wav" in download_url:
+        file_extension = "wav"
+    return file_extension
+
+def filter_tracks(all_tracks: list[CompactTrack], request: "TrackSearchRequest"):
+    """
+    Applies the license and attribute filters of a search request using
+    integer bit tests against each track's attribute masks.
+    """
+    if request.license_type:
+        license_code = LICENSES.index.get(request.license_type)
+        tracks_to_search = [track for track in all_tracks if track.license == license_code]
+    else:
+        tracks_to_search = all_tracks
+    if not request.attributes:
+        return tracks_to_search
+
+    genre, mood, instrument = request.attributes.genre, request.attributes.mood, request.attributes.instrument
+    if genre is None and mood is None and instrument is None:
+        return []
+
+    # A value that no track has ever carried maps to bit 0 and never matches
+    genre_bit = GENRES.bit(genre) if genre is not None else 0
+    mood_bit = MOODS.bit(mood) if mood is not None else 0
+    instrument_bit = INSTRUMENTS.bit(instrument) if instrument is not None else 0
+
+    if request.use_or_logic:
+        return [
+            track for track in tracks_to_search
+            if track.genres & genre_bit or track.moods & mood_bit or track.instruments & instrument_bit
+        ]
+
+    if (genre is not None and not genre_bit) or (mood is not None and not mood_bit) \
+            or (instrument is not None and not instrument_bit):
+        return []
+    return [
+        track for track in tracks_to_search
+        if track.genres & genre_bit == genre_bit
+        and track.moods & mood_bit == mood_bit
+        and track.instruments & instrument_bit == instrument_bit
+    ]
+
 
 
 # 2. Define a "route" or "endpoint" for the main URL ("/")
@@ -91,6 +196,13 @@ def get_available_attributes():
     """
     return attributes
 
+@app.get("/health/upstreams")
+def get_upstream_health():
+    """
+    Reports circuit breaker state and concurrency usage for each upstream.
+    """
+    return {"studio": studio_guard.stats(), "media": media_guard.stats()}
+
 @app.post("/tracks/refresh", dependencies=[Depends(get_api_key)])
 def refresh_track_database():
     """
@@ -102,11 +214,11 @@ def refresh_track_database():
     print("Force refresh of track database initiated...")
     try:
         result = get_all_tracks_from_youtube()
-        attributes = result.get("available_attributes", {})
-        
         if result.get("error"):
             raise HTTPException(status_code=500, detail=result["error"])
 
+        attributes = result.get("available_attributes", {})
+
         print("Track database refresh completed successfully.")
         return {"status": "success", "message": f"Successfully scraped and saved {result.get('count', 0)} tracks."}
 
@@ -119,65 +231,85 @@ def get_all_tracks():
     """
     Returns the entire list of tracks without any filtering.
     """
-    return load_tracks_from_db()
+    return json_response(join_tracks(load_catalog()["tracks"]))
 
 
 @app.post("/tracks/search", dependencies=[Depends(get_api_key)])
-def search_tracks(request: TrackSearchRequest):
+def search_tracks(
+    request: TrackSearchRequest,
+    if_none_match: Optional[str] = Header(default=None),
+):
     """
     Searches for tracks based on license, genres, moods, and instruments.
+    Results are cached per catalog version and tagged with an ETag, so a
+    client revalidating with If-None-Match gets a bodyless 304.
+    """
+    current = load_catalog()
+    version = current["version"]
+    key = normalize_search_key(
+        request.attributes.genre,
+        request.attributes.mood,
+        request.attributes.instrument,
+        request.license_type,
+        request.use_or_logic,
+    )
+    etag = make_etag(version, key)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    body = search_cache.get(version, key)
+    if body is None:
+        matches = filter_tracks(current["tracks"], request)
+        body = join_tracks(matches)
+        search_cache.put(version, key, body)
+
+    return json_response(body, headers={"ETag": etag})
+
+
+@app.post("/tracks/similar", dependencies=[Depends(get_api_key)])
+def get_similar_tracks(request: SimilarTracksRequest):
     """
-    all_tracks = load_tracks_from_db()
-    filtered_tracks = []
+    Returns the k tracks whose genres, moods and instruments are most
+    similar to the given track(s), best first, each with its score.
+    """
+    current = load_catalog()
+    index = current["similarity"]
+    rows = index.rows_for(request.track_ids)
+    if not rows:
+        raise HTTPException(status_code=404, detail="None of the given track IDs are in the catalog.")
 
+    license_code = None
     if request.license_type:
-        tracks_to_search = [
-            track for track in all_tracks 
-            if track.get("licenseType", "") == request.license_type
-        ]
-    else:
-        tracks_to_search = all_tracks
-    if not request.attributes:
-        return tracks_to_search
+        license_code = LICENSES.index.get(request.license_type)
+        if license_code is None:
+            return json_response(b"[]")
 
-    filtered_tracks = []
-    for track in tracks_to_search:
-        # Get the track's attributes, with empty lists as a fallback
-        track_genres = track.get("attributes", {}).get("genres", [])
-        track_moods = track.get("attributes", {}).get("moods", [])
-        track_instruments = track.get("attributes", {}).get("instruments", [])
-
-        # Build a list of conditions that must be met
-        conditions = []
-        if request.attributes.genre is not None:
-            conditions.append(request.attributes.genre in track_genres)
-        if request.attributes.mood is not None:
-            conditions.append(request.attributes.mood in track_moods)
-        if request.attributes.instrument is not None:
-            conditions.append(request.attributes.instrument in track_instruments)
-
-        if not conditions:
-            continue
-
-        if request.use_or_logic:
-            if any(conditions):
-                filtered_tracks.append(track)
-        else:
-            if all(conditions):
-                filtered_tracks.append(track)
-                
-    return filtered_tracks
+    tracks = current["tracks"]
+    results = [
+        b'{"score":' + json_backend.dumps(round(score, 4)) + b',"track":' + tracks[row].encoded + b"}"
+        for row, score in index.top_k(rows, request.k, request.metric, license_code)
+    ]
+    return json_response(json_backend.join_array(results))
 
 
-@app.get("/tracks/{track_id}/download", dependencies=[Depends(get_api_key)])
-def download_track(track_id: str):
+@app.get("/tracks/popular", dependencies=[Depends(get_api_key)])
+def get_popular_tracks(limit: int = Query(default=20, ge=1, le=200)):
     """
-    Takes a track_id, gets the temporary download URL, and streams
-    the audio file back to the client.
+    Returns the most downloaded tracks by recency-weighted request count,
+    and whether each one's download URL and audio are already cached.
     """
-    print(f"Received download request for track_id: {track_id}")
+    return prefetcher.ranking(limit)
+
 
-    track_info = get_download_url_for_track([track_id])
+def resolve_download_url(track_id: str):
+    """Asks Studio for a fresh download URL for track_id and caches it."""
+    try:
+        track_info = get_download_url_for_track([track_id], skip_missing=True)
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    if track_info is None:
+        raise HTTPException(status_code=502, detail="Studio kept rejecting our tokens after refreshing them.")
 
     # 2. Handle any errors from the utility function
     if "error" in track_info:
@@ -188,14 +320,68 @@ def download_track(track_id: str):
         raise HTTPException(status_code=404, detail=f"Track ID {track_id} not found or no URL returned.")
 
     filename, download_url = track_info[track_id]
+    prefetcher.urls.put(track_id, filename, download_url)
+    return filename, download_url
 
-    file_extension = "mp3" # Default to mp3
-    if ".wav" in download_url:
-        file_extension = "wav"
+
+def open_cached_stream(track_id: str, download_url: str):
+    """
+    Opens a stream from a cached URL. If the download host rejects it, the
+    cached URL and audio are dropped and None is returned so the caller can
+    resolve a fresh one.
+    """
+    try:
+        chunks = open_track_stream(download_url)
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        print(f"Cached URL for {track_id} failed ({e}), resolving a fresh one...")
+        prefetcher.forget(track_id)
+        return None
+    if chunks.empty:
+        print(f"Cached URL for {track_id} returned no data, resolving a fresh one...")
+        chunks.close()
+        prefetcher.forget(track_id)
+        return None
+    return chunks
+
+
+@app.get("/tracks/{track_id}/download", dependencies=[Depends(get_api_key)])
+def download_track(track_id: str):
+    """
+    Takes a track_id, gets the temporary download URL, and streams
+    the audio file back to the client.
+    """
+    print(f"Received download request for track_id: {track_id}")
+
+    cached_audio = prefetcher.audio.get(track_id)
+    if cached_audio is not None:
+        filename, download_url, data = cached_audio
+        prefetcher.popularity.hit(track_id)
+        return Response(
+            content=data,
+            media_type="audio/mpeg",
+            headers={"Content-Disposition": f"attachment; filename=\"{filename}.{track_file_extension(download_url)}\""}
+        )
+
+    chunks = None
+    cached_url = prefetcher.urls.get(track_id)
+    if cached_url is not None:
+        filename, download_url = cached_url
+        chunks = open_cached_stream(track_id, download_url)
+
+    if chunks is None:
+        filename, download_url = resolve_download_url(track_id)
+        try:
+            chunks = open_track_stream(download_url)
+        except UpstreamUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    # Only tracks Studio actually resolved count towards popularity
+    prefetcher.popularity.hit(track_id)
 
     return StreamingResponse(
-        stream_track_from_url(download_url),
+        chunks,
         media_type="audio/mpeg",
-        headers={"Content-Disposition": f"attachment; filename=\"{filename}.{file_extension}\""}
+        headers={"Content-Disposition": f"attachment; filename=\"{filename}.{track_file_extension(download_url)}\""}
     )
-    
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from utils.search_cache import SearchCache
+from utils.similarity import SimilarityIndex
+
+ROCK = "CREATOR_MUSIC_GENRE_ROCK"
+POP = "CREATOR_MUSIC_GENRE_POP"
+HAPPY = "CREATOR_MUSIC_MOOD_HAPPY"
+SAD = "CREATOR_MUSIC_MOOD_SAD"
+PIANO = "CREATOR_MUSIC_INSTRUMENT_PIANO"
+DRUMS = "CREATOR_MUSIC_INSTRUMENT_DRUMS"
+CCBY = "CREATOR_MUSIC_LICENSE_TYPE_CCBY_4"
+YOUTUBE = "CREATOR_MUSIC_LICENSE_TYPE_YOUTUBE"
+
+
+def make_track(track_id, genres=(), moods=(), instruments=(), license_type=CCBY, **extra):
+    return {
+        "trackId": track_id,
+        "title": f"Track {track_id}",
+        "licenseType": license_type,
+        "attributes": {"genres": list(genres), "moods": list(moods), "instruments": list(instruments)},
+        **extra,
+    }
+
+
+@pytest.fixture
+def write_catalog(tmp_path, monkeypatch):
+    """Points main at a temp track database; each call writes tracks to it and drops what main has loaded."""
+    path = tmp_path / "tracks.json"
+    monkeypatch.setattr(main, "TRACKS_DB_FILE", str(path))
+
+    def write(tracks):
+        monkeypatch.setattr(main, "catalog", {"version": None, "tracks": [], "similarity": SimilarityIndex([])})
+        monkeypatch.setattr(main, "search_cache", SearchCache())
+        path.write_text(json.dumps({"collected": len(tracks), "tracks": tracks}), encoding="utf-8")
+        return path
+
+    return write
+
+
+@pytest.fixture
+def api_client(monkeypatch):
+    monkeypatch.setattr(main, "API_KEY", "key")
+    # No context manager: the lifespan (and the prefetch thread) is not started
+    return TestClient(main.app, headers={"X-API-Key": "key"})
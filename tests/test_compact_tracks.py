@@ -0,0 +1,38 @@
+import json
+
+from utils.compact_tracks import CompactTrack, GENRES, LICENSES, NO_LICENSE, join_tracks
+
+TRACK = {
+    "trackId": "abc",
+    "title": "Song",
+    "licenseType": "CREATOR_MUSIC_LICENSE_TYPE_CCBY_4",
+    "attributes": {
+        "genres": ["CREATOR_MUSIC_GENRE_ROCK", "CREATOR_MUSIC_GENRE_POP"],
+        "moods": ["CREATOR_MUSIC_MOOD_HAPPY"],
+        "instruments": [],
+    },
+}
+
+
+def test_encoded_round_trips():
+    for track in (TRACK, {}, {"trackId": "x"}, {"licenseType": "L"}, {"attributes": {}}):
+        assert json.loads(CompactTrack.from_dict(track).encoded) == track
+
+
+def test_join_tracks_builds_json_array():
+    tracks = [CompactTrack.from_dict(TRACK), CompactTrack.from_dict({"trackId": "y"})]
+    assert json.loads(join_tracks(tracks)) == [TRACK, {"trackId": "y"}]
+    assert json.loads(join_tracks([])) == []
+
+
+def test_masks_and_license_codes():
+    track = CompactTrack.from_dict(TRACK)
+    assert track.genres == GENRES.bit("CREATOR_MUSIC_GENRE_ROCK") | GENRES.bit("CREATOR_MUSIC_GENRE_POP")
+    assert track.license == LICENSES.index["CREATOR_MUSIC_LICENSE_TYPE_CCBY_4"]
+    assert CompactTrack.from_dict({"trackId": "z"}).license == NO_LICENSE
+
+
+def test_attribute_fragments_are_shared_between_tracks():
+    first = CompactTrack.from_dict(TRACK)
+    second = CompactTrack.from_dict(dict(TRACK, trackId="def", title="Other"))
+    assert first.tail is second.tail
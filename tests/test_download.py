@@ -0,0 +1,106 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from utils.popularity import Prefetcher
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.empty = not chunks
+        self.closed = False
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "API_KEY", "key")
+    monkeypatch.setattr(main, "prefetcher", Prefetcher())
+    # No context manager: the lifespan (and the prefetch thread) is not started
+    return TestClient(main.app, headers={"X-API-Key": "key"})
+
+
+def resolve_with(monkeypatch, urls):
+    calls = []
+
+    def resolve(track_ids, skip_missing=False):
+        calls.append(track_ids)
+        if track_ids[0] not in urls:
+            if skip_missing:
+                return {}
+            raise RuntimeError("No track object returned in get_tracks response.")
+        return {track_ids[0]: ("Song", urls[track_ids[0]])}
+
+    monkeypatch.setattr(main, "get_download_url_for_track", resolve)
+    return calls
+
+
+def test_unknown_track_is_not_counted(client, monkeypatch):
+    resolve_with(monkeypatch, {})
+    response = client.get("/tracks/missing/download")
+    assert response.status_code == 404
+    assert main.prefetcher.popularity.top(5) == []
+
+
+def test_token_refresh_failure_is_a_bad_gateway(client, monkeypatch):
+    monkeypatch.setattr(main, "get_download_url_for_track", lambda track_ids, skip_missing=False: None)
+    response = client.get("/tracks/t1/download")
+    assert response.status_code == 502
+    assert main.prefetcher.popularity.top(5) == []
+
+
+def test_resolved_track_is_counted_and_url_cached(client, monkeypatch):
+    calls = resolve_with(monkeypatch, {"t1": "https://audio.example/fresh"})
+    monkeypatch.setattr(main, "open_track_stream", lambda url: FakeStream([b"abc"]))
+    for _ in range(2):
+        response = client.get("/tracks/t1/download")
+        assert response.status_code == 200
+        assert response.content == b"abc"
+    assert calls == [["t1"]]
+    assert [tid for tid, _ in main.prefetcher.popularity.top(5)] == ["t1"]
+
+
+def test_rejected_cached_url_is_dropped(client, monkeypatch):
+    resolve_with(monkeypatch, {"t1": "https://audio.example/fresh"})
+    main.prefetcher.urls.put("t1", "Song", "https://audio.example/revoked")
+
+    def open_stream(url):
+        if "revoked" in url:
+            raise ConnectionError("403 Forbidden")
+        return FakeStream([b"fresh"])
+
+    monkeypatch.setattr(main, "open_track_stream", open_stream)
+    response = client.get("/tracks/t1/download")
+    assert response.content == b"fresh"
+    assert main.prefetcher.urls.get("t1") == ("Song", "https://audio.example/fresh")
+
+
+def test_empty_stream_from_cached_url_is_dropped(client, monkeypatch):
+    resolve_with(monkeypatch, {"t1": "https://audio.example/fresh"})
+    main.prefetcher.urls.put("t1", "Song", "https://audio.example/revoked")
+    streams = []
+
+    def open_stream(url):
+        streams.append(FakeStream([] if "revoked" in url else [b"fresh"]))
+        return streams[-1]
+
+    monkeypatch.setattr(main, "open_track_stream", open_stream)
+    response = client.get("/tracks/t1/download")
+    assert response.content == b"fresh"
+    assert streams[0].closed
+    assert main.prefetcher.urls.get("t1")[1] == "https://audio.example/fresh"
+
+
+def test_cached_audio_is_served_without_upstream(client, monkeypatch):
+    calls = resolve_with(monkeypatch, {})
+    main.prefetcher.audio.put("t1", "Song", "https://audio.example/x.wav", b"wave")
+    response = client.get("/tracks/t1/download")
+    assert response.content == b"wave"
+    assert 'filename="Song.wav"' in response.headers["content-disposition"]
+    assert calls == []
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from tests.conftest import make_track, ROCK, POP, HAPPY, SAD, PIANO, CCBY, YOUTUBE
+from utils import json_backend
+
+TRACKS = [
+    make_track("a", genres=[ROCK, POP], moods=[HAPPY], instruments=[PIANO], title="Ünïcødé — “quotes” \\ / ☃",
+               duration=183.25, artist={"name": "Ø", "tags": [None, True, 0]}),
+    make_track("b", genres=[ROCK], moods=[SAD], title="Line\nbreak\ttab\x01", duration=0.1, rank=2**40),
+    make_track("c", genres=[POP], license_type=YOUTUBE),
+    {"trackId": "d", "licenseType": CCBY, "title": "No attributes"},
+]
+SEARCH = {"attributes": {"genre": ROCK}, "license_type": CCBY}
+
+
+def legacy_body(tracks):
+    """What the endpoints returned before: the dicts through jsonable_encoder and JSONResponse."""
+    return JSONResponse(jsonable_encoder(tracks)).body
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def backend(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_backend, "orjson", None)
+    return request.param
+
+
+def test_all_tracks_body_matches_legacy_encoding(backend, write_catalog, api_client):
+    write_catalog(TRACKS)
+    response = api_client.get("/tracks/all")
+    assert response.headers["content-type"] == "application/json"
+    assert json.loads(response.content) == json.loads(legacy_body(TRACKS))
+
+
+def test_search_body_matches_legacy_encoding(backend, write_catalog, api_client):
+    write_catalog(TRACKS)
+    response = api_client.post("/tracks/search", json=SEARCH)
+    assert json.loads(response.content) == json.loads(legacy_body(TRACKS[:2]))
+
+
+def test_backends_produce_identical_bytes(write_catalog, api_client, monkeypatch):
+    pytest.importorskip("orjson")
+    bodies = []
+    for orjson in (json_backend.orjson, None):
+        monkeypatch.setattr(json_backend, "orjson", orjson)
+        write_catalog(TRACKS)
+        bodies.append((api_client.get("/tracks/all").content,
+                       api_client.post("/tracks/search", json=SEARCH).content))
+    assert bodies[0] == bodies[1]
+
+
+def test_dumps_encodes_integers_beyond_64_bits(backend):
+    assert json_backend.dumps({"n": 2**70, "m": -(2**64)}) == b'{"n":1180591620717411303424,"m":-18446744073709551616}'
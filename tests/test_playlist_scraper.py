@@ -0,0 +1,97 @@
+import json
+import os
+import stat
+
+import pytest
+import requests
+
+from utils import playlist_scraper
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self.data = data or {}
+        self.text = json.dumps(self.data)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def json(self):
+        return self.data
+
+
+def page(track_ids, next_token=None):
+    page_info = {"nextPageToken": next_token} if next_token else {}
+    return FakeResponse(data={"tracks": [{"trackId": tid} for tid in track_ids], "pageInfo": page_info})
+
+
+@pytest.fixture
+def fake_studio(monkeypatch):
+    responses = []
+    monkeypatch.setattr(playlist_scraper, "load_cfg", lambda: {})
+    monkeypatch.setattr(playlist_scraper, "get_headers", lambda cfg: {})
+    monkeypatch.setattr(playlist_scraper, "get_payload", lambda cfg: {"pageInfo": {}})
+    monkeypatch.setattr(playlist_scraper.time, "sleep", lambda secs: None)
+    monkeypatch.setattr(playlist_scraper.requests, "post", lambda *args, **kwargs: responses.pop(0))
+    return responses
+
+
+def write_catalog(path, track_ids):
+    path.write_text(json.dumps({"tracks": [{"trackId": tid} for tid in track_ids]}), encoding="utf-8")
+
+
+def read_track_ids(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [t["trackId"] for t in json.load(f)["tracks"]]
+
+
+def test_streams_pages_and_deduplicates(tmp_path, fake_studio):
+    output = tmp_path / "tracks.json"
+    fake_studio += [page(["a", "b"], next_token="p2"), page(["b", "c"])]
+    result = playlist_scraper.get_all_tracks(str(output))
+    assert result["success"] and result["count"] == 3
+    assert read_track_ids(output) == ["a", "b", "c"]
+    assert os.listdir(tmp_path) == ["tracks.json"]
+
+
+def test_http_error_keeps_existing_catalog(tmp_path, fake_studio):
+    output = tmp_path / "tracks.json"
+    write_catalog(output, ["old1", "old2"])
+    fake_studio += [page(["a"], next_token="p2"), FakeResponse(status_code=500)]
+    result = playlist_scraper.get_all_tracks(str(output))
+    assert not result["success"]
+    assert "error" in result
+    assert read_track_ids(output) == ["old1", "old2"]
+    assert os.listdir(tmp_path) == ["tracks.json"]
+
+
+def test_exception_keeps_existing_catalog(tmp_path, fake_studio, monkeypatch):
+    output = tmp_path / "tracks.json"
+    write_catalog(output, ["old"])
+
+    def fail(*args, **kwargs):
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(playlist_scraper.requests, "post", fail)
+    with pytest.raises(requests.ConnectionError):
+        playlist_scraper.get_all_tracks(str(output))
+    assert read_track_ids(output) == ["old"]
+    assert os.listdir(tmp_path) == ["tracks.json"]
+
+
+def test_keeps_existing_file_mode(tmp_path, fake_studio):
+    output = tmp_path / "tracks.json"
+    write_catalog(output, ["old"])
+    os.chmod(output, 0o644)
+    fake_studio.append(page(["a"]))
+    playlist_scraper.get_all_tracks(str(output))
+    assert stat.S_IMODE(os.stat(output).st_mode) == 0o644
+
+
+def test_new_file_gets_umask_default_mode(tmp_path, fake_studio):
+    output = tmp_path / "tracks.json"
+    fake_studio.append(page(["a"]))
+    playlist_scraper.get_all_tracks(str(output))
+    assert stat.S_IMODE(os.stat(output).st_mode) == playlist_scraper.DEFAULT_FILE_MODE
@@ -0,0 +1,190 @@
+import pytest
+import requests
+
+from utils import popularity
+from utils.popularity import AudioCache, DecayingCounter, Prefetcher, SignedUrlCache
+from utils.upstream_guard import UpstreamUnavailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(popularity.time, "monotonic", fake)
+    return fake
+
+
+def url_for(tid):
+    return f"https://audio.example/{tid}?expire=9999999999"
+
+
+def test_counter_ranks_by_hits(clock):
+    counter = DecayingCounter(half_life=60)
+    for tid in "aaabbc":
+        counter.hit(tid)
+    assert [tid for tid, _ in counter.top(2)] == ["a", "b"]
+
+
+def test_counter_decays_by_half_life(clock):
+    counter = DecayingCounter(half_life=60)
+    counter.hit("old", weight=4)
+    clock.now += 120
+    counter.hit("new", weight=2)
+    scores = dict(counter.top(2))
+    assert scores["old"] == pytest.approx(1.0)
+    assert scores["new"] == pytest.approx(2.0)
+
+
+def test_counter_rebase_keeps_scores(clock):
+    counter = DecayingCounter(half_life=1)
+    counter.hit("a")
+    clock.now += 40
+    counter.hit("b")
+    clock.now += 40
+    counter.hit("b")
+    assert dict(counter.top(2))["b"] == pytest.approx(1.0 + 2.0 ** -40)
+
+
+def test_counter_is_bounded_and_forgets(clock):
+    counter = DecayingCounter(max_tracked=4)
+    for i in range(5):
+        counter.hit(str(i), weight=i + 1)
+    assert len(counter.scores) == 2
+    counter.forget("4")
+    assert [tid for tid, _ in counter.top(5)] == ["3"]
+
+
+def test_url_cache_expires_before_signed_expiry(monkeypatch):
+    cache = SignedUrlCache(refresh_margin=60)
+    monkeypatch.setattr(popularity.time, "time", lambda: 1000.0)
+    cache.put("a", "Title", "https://audio.example/a?expire=1100")
+    assert cache.get("a") == ("Title", "https://audio.example/a?expire=1100")
+    monkeypatch.setattr(popularity.time, "time", lambda: 1050.0)
+    assert cache.get("a") is None
+
+
+def test_audio_cache_is_bounded_by_bytes():
+    cache = AudioCache(max_bytes=10)
+    cache.put("a", "A", "u", b"x" * 6)
+    cache.put("b", "B", "u", b"y" * 6)
+    assert "a" not in cache
+    assert cache.get("b")[2] == b"y" * 6
+    cache.discard("b")
+    assert cache.size == 0
+
+
+@pytest.fixture
+def prefetcher():
+    fetcher = Prefetcher(top_n=5, prefetch_audio=True)
+    for tid in "aaabbc":
+        fetcher.popularity.hit(tid)
+    return fetcher
+
+
+def test_prefetch_resolves_hot_tracks_in_one_batch(monkeypatch, prefetcher):
+    calls = []
+
+    def resolve(track_ids, skip_missing=False):
+        calls.append(list(track_ids))
+        return {tid: (tid.upper(), url_for(tid)) for tid in track_ids}
+
+    monkeypatch.setattr(popularity, "get_download_url_for_track", resolve)
+    monkeypatch.setattr(popularity, "read_audio", lambda url: b"audio")
+    prefetcher.prefetch()
+    prefetcher.prefetch()
+    assert calls == [["a", "b", "c"]]
+    assert prefetcher.audio.get("a") == ("A", url_for("a"), b"audio")
+
+
+def test_prefetch_drops_ids_missing_from_batch(monkeypatch, prefetcher):
+    monkeypatch.setattr(
+        popularity, "get_download_url_for_track",
+        lambda track_ids, skip_missing=False: {tid: (tid, url_for(tid)) for tid in track_ids if tid != "b"},
+    )
+    monkeypatch.setattr(popularity, "read_audio", lambda url: b"audio")
+    prefetcher.prefetch()
+    assert prefetcher.urls.get("a") is not None
+    assert "b" not in dict(prefetcher.popularity.top(5))
+
+
+def test_prefetch_falls_back_to_single_lookups(monkeypatch, prefetcher):
+    def resolve(track_ids, skip_missing=False):
+        if "b" in track_ids:
+            response = requests.Response()
+            response.status_code = 400
+            raise requests.HTTPError("bad id", response=response)
+        return {tid: (tid, url_for(tid)) for tid in track_ids}
+
+    monkeypatch.setattr(popularity, "get_download_url_for_track", resolve)
+    monkeypatch.setattr(popularity, "read_audio", lambda url: b"audio")
+    prefetcher.prefetch()
+    assert prefetcher.urls.get("a") is not None
+    assert prefetcher.urls.get("c") is not None
+    assert [tid for tid, _ in prefetcher.popularity.top(5)] == ["a", "c"]
+
+
+def test_prefetch_keeps_ranking_when_studio_errors(monkeypatch, prefetcher):
+    def resolve(track_ids, skip_missing=False):
+        response = requests.Response()
+        response.status_code = 502
+        raise requests.HTTPError("bad gateway", response=response)
+
+    monkeypatch.setattr(popularity, "get_download_url_for_track", resolve)
+    with pytest.raises(requests.HTTPError):
+        prefetcher.prefetch()
+    assert len(prefetcher.popularity.top(5)) == 3
+
+
+def test_oversized_audio_is_not_downloaded_again(monkeypatch, prefetcher):
+    downloads = []
+    monkeypatch.setattr(
+        popularity, "get_download_url_for_track",
+        lambda track_ids, skip_missing=False: {tid: (tid, url_for(tid)) for tid in track_ids},
+    )
+    monkeypatch.setattr(popularity, "read_audio", lambda url: downloads.append(url))
+    prefetcher.prefetch()
+    prefetcher.prefetch()
+    assert len(downloads) == 3
+    assert prefetcher.too_large == {"a", "b", "c"}
+
+
+def resolve_all(track_ids, skip_missing=False):
+    return {tid: (tid, url_for(tid)) for tid in track_ids}
+
+
+def test_failed_audio_prefetch_skips_only_that_track(monkeypatch, prefetcher):
+    def read(url):
+        if "/b?" in url:
+            raise ConnectionError("403 Forbidden")
+        return b"" if "/c?" in url else b"audio"
+
+    monkeypatch.setattr(popularity, "get_download_url_for_track", resolve_all)
+    monkeypatch.setattr(popularity, "read_audio", read)
+    prefetcher.prefetch()
+    assert "a" in prefetcher.audio
+    assert "b" not in prefetcher.audio and "c" not in prefetcher.audio
+    # Rejected and empty URLs are dropped so the next cycle resolves them again
+    assert prefetcher.urls.get("b") is None and prefetcher.urls.get("c") is None
+    assert prefetcher.urls.get("a") is not None
+
+
+def test_audio_prefetch_stops_when_download_host_sheds(monkeypatch, prefetcher):
+    reads = []
+
+    def read(url):
+        reads.append(url)
+        raise UpstreamUnavailable("audio download host", "circuit open", 30)
+
+    monkeypatch.setattr(popularity, "get_download_url_for_track", resolve_all)
+    monkeypatch.setattr(popularity, "read_audio", read)
+    with pytest.raises(UpstreamUnavailable):
+        prefetcher.prefetch()
+    assert len(reads) == 1
+    assert prefetcher.urls.get("a") is not None
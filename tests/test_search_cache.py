@@ -0,0 +1,61 @@
+from utils.search_cache import SearchCache, normalize_search_key, make_etag, etag_matches
+
+
+def test_normalize_search_key_treats_none_and_false_alike():
+    assert normalize_search_key("g", None, None, "L", None) == normalize_search_key("g", None, None, "L", False)
+
+
+def test_get_returns_stored_body_for_same_version():
+    cache = SearchCache()
+    cache.put("v1", "k", b"[1]")
+    assert cache.get("v1", "k") == b"[1]"
+
+
+def test_version_change_drops_everything():
+    cache = SearchCache()
+    cache.put("v1", "k", b"[1]")
+    assert cache.get("v2", "k") is None
+    assert cache.size == 0
+
+
+def test_evicts_least_recently_used_by_count():
+    cache = SearchCache(maxsize=2)
+    cache.put("v", "a", b"a")
+    cache.put("v", "b", b"b")
+    cache.get("v", "a")
+    cache.put("v", "c", b"c")
+    assert cache.get("v", "b") is None
+    assert cache.get("v", "a") == b"a"
+    assert cache.get("v", "c") == b"c"
+
+
+def test_evicts_by_total_bytes():
+    cache = SearchCache(max_bytes=10)
+    cache.put("v", "a", b"x" * 6)
+    cache.put("v", "b", b"y" * 6)
+    assert cache.get("v", "a") is None
+    assert cache.get("v", "b") == b"y" * 6
+    assert cache.size == 6
+
+
+def test_skips_bodies_over_entry_limit():
+    cache = SearchCache(max_entry_bytes=4)
+    cache.put("v", "a", b"small")
+    assert cache.get("v", "a") is None
+    assert cache.size == 0
+
+
+def test_replacing_a_key_keeps_size_accurate():
+    cache = SearchCache()
+    cache.put("v", "a", b"xxxx")
+    cache.put("v", "a", b"yy")
+    assert cache.size == 2
+
+
+def test_etag_matching():
+    etag = make_etag("v1", ("g", None, None, None, False))
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert etag != make_etag("v2", ("g", None, None, None, False))
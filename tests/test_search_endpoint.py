@@ -0,0 +1,75 @@
+import os
+
+from tests.conftest import make_track, ROCK, POP, HAPPY, CCBY, YOUTUBE
+
+import main
+
+TRACKS = [
+    make_track("a", genres=[ROCK], moods=[HAPPY]),
+    make_track("b", genres=[POP]),
+    make_track("c", genres=[ROCK], license_type=YOUTUBE),
+]
+QUERY = {"attributes": {"genre": ROCK}, "license_type": CCBY}
+
+
+def ids(response):
+    return [track["trackId"] for track in response.json()]
+
+
+def test_search_filters_and_sets_etag(write_catalog, api_client):
+    write_catalog(TRACKS)
+    response = api_client.post("/tracks/search", json=QUERY)
+    assert response.status_code == 200
+    assert ids(response) == ["a"]
+    assert response.headers["etag"].startswith('"')
+
+
+def test_matching_if_none_match_gets_bodyless_304(write_catalog, api_client):
+    write_catalog(TRACKS)
+    etag = api_client.post("/tracks/search", json=QUERY).headers["etag"]
+    response = api_client.post("/tracks/search", json=QUERY, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_etag_differs_per_query(write_catalog, api_client):
+    write_catalog(TRACKS)
+    first = api_client.post("/tracks/search", json=QUERY).headers["etag"]
+    other = api_client.post("/tracks/search", json={"attributes": {"genre": POP}}).headers["etag"]
+    assert first != other
+
+
+def test_catalog_replace_changes_etag_and_results(write_catalog, api_client):
+    path = write_catalog(TRACKS)
+    etag = api_client.post("/tracks/search", json=QUERY).headers["etag"]
+    stat = os.stat(path)
+
+    # Same size and mtime, new inode: only st_ino tells the versions apart
+    replacement = path.with_name("replacement.json")
+    replacement.write_bytes(path.read_bytes().replace(b'"trackId": "a"', b'"trackId": "z"'))
+    os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(replacement, path)
+
+    response = api_client.post("/tracks/search", json=QUERY, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert ids(response) == ["z"]
+    assert response.headers["etag"] != etag
+
+
+def test_version_comes_from_the_file_that_was_read(write_catalog, monkeypatch):
+    path = write_catalog(TRACKS)
+    stat_version = main.get_catalog_version
+
+    # The scraper's os.replace lands between load_catalog's stat and its read
+    def stat_then_replace():
+        version = stat_version()
+        replacement = path.with_name("replacement.json")
+        replacement.write_bytes(path.read_bytes().replace(b'"trackId": "a"', b'"trackId": "z"'))
+        os.replace(replacement, path)
+        return version
+
+    monkeypatch.setattr(main, "get_catalog_version", stat_then_replace)
+    current = main.load_catalog()
+    assert current["tracks"][0].track_id == "z"
+    assert current["version"] == main.catalog_version(os.stat(path))
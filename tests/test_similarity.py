@@ -0,0 +1,86 @@
+import math
+
+import pytest
+
+from tests.conftest import make_track, ROCK, POP, HAPPY, SAD, PIANO, DRUMS, CCBY, YOUTUBE
+from utils.compact_tracks import CompactTrack, LICENSES
+from utils.similarity import SimilarityIndex
+
+# Rows: w comes before x, and both overlap the seed s equally
+CATALOG = [
+    make_track("s", genres=[ROCK], moods=[HAPPY], instruments=[PIANO]),
+    make_track("w", genres=[ROCK], moods=[HAPPY], license_type=YOUTUBE),
+    make_track("y", genres=[ROCK], moods=[SAD], instruments=[DRUMS]),
+    make_track("x", genres=[ROCK], moods=[HAPPY]),
+    make_track("z", genres=[POP], moods=[SAD]),
+    make_track("t", genres=[ROCK], moods=[HAPPY], instruments=[PIANO, DRUMS]),
+]
+
+
+@pytest.fixture
+def index():
+    return SimilarityIndex([CompactTrack.from_dict(track) for track in CATALOG])
+
+
+def ranked(index, seeds, k=10, **kwargs):
+    return [(CATALOG[row]["trackId"], score) for row, score in index.top_k(index.rows_for(seeds), k, **kwargs)]
+
+
+def test_jaccard_scores(index):
+    result = ranked(index, ["s"])
+    assert [tid for tid, _ in result] == ["t", "w", "x", "y"]
+    assert [score for _, score in result] == pytest.approx([3 / 4, 2 / 3, 2 / 3, 1 / 5])
+
+
+def test_cosine_scores(index):
+    result = ranked(index, ["s"], metric="cosine")
+    assert [tid for tid, _ in result] == ["t", "w", "x", "y"]
+    expected = [3 / (math.sqrt(3) * 2), 2 / (math.sqrt(3) * math.sqrt(2)), 2 / (math.sqrt(3) * math.sqrt(2)), 1 / 3]
+    assert [score for _, score in result] == pytest.approx(expected)
+
+
+def test_multiple_seeds_use_union_and_mean(index):
+    # Union of s and z: rock, pop, happy, sad, piano
+    assert dict(ranked(index, ["s", "z"]))["y"] == pytest.approx(2 / 6)
+    # Mean of s and z has half weights on all five attributes
+    assert dict(ranked(index, ["s", "z"], metric="cosine"))["y"] == pytest.approx(1 / (math.sqrt(1.25) * math.sqrt(3)))
+
+
+def test_seeds_and_zero_overlap_are_excluded(index):
+    tids = [tid for tid, _ in ranked(index, ["s", "t"])]
+    assert "s" not in tids and "t" not in tids
+    assert "z" in [tid for tid, _ in ranked(index, ["y"])]
+    assert "z" not in [tid for tid, _ in ranked(index, ["s"])]
+
+
+def test_ties_keep_catalog_order(index):
+    assert ranked(index, ["s"], k=2) == [("t", pytest.approx(0.75)), ("w", pytest.approx(2 / 3))]
+    assert [tid for tid, _ in ranked(index, ["t"], k=3)][1:] == ["w", "x"]
+
+
+def test_license_filter(index):
+    assert [tid for tid, _ in ranked(index, ["s"], license_code=LICENSES.index[YOUTUBE])] == ["w"]
+    assert "w" not in [tid for tid, _ in ranked(index, ["s"], license_code=LICENSES.index[CCBY])]
+
+
+def test_unknown_and_duplicate_ids_are_ignored(index):
+    assert index.rows_for(["nope", "x", "x", "s"]) == [3, 0]
+    assert SimilarityIndex([]).rows_for(["s"]) == []
+
+
+def test_similar_endpoint(write_catalog, api_client):
+    write_catalog(CATALOG)
+    response = api_client.post("/tracks/similar", json={"track_ids": ["s", "nope"], "k": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["track"]["trackId"] for item in body] == ["t", "w"]
+    assert body[0] == {"score": 0.75, "track": CATALOG[5]}
+
+    response = api_client.post("/tracks/similar", json={"track_ids": ["s"], "license_type": YOUTUBE})
+    assert [item["track"]["trackId"] for item in response.json()] == ["w"]
+
+
+def test_similar_endpoint_404_when_no_seed_known(write_catalog, api_client):
+    write_catalog(CATALOG)
+    response = api_client.post("/tracks/similar", json={"track_ids": ["nope", "gone"]})
+    assert response.status_code == 404
@@ -0,0 +1,233 @@
+import threading
+import time
+
+import pytest
+
+from utils import upstream_guard
+from utils.upstream_guard import (
+    AdaptiveLimit, CircuitBreaker, UpstreamGuard, UpstreamUnavailable, CLOSED, OPEN, HALF_OPEN,
+)
+
+
+def tripped_breaker(now=0.0, **kwargs):
+    breaker = CircuitBreaker(min_calls=2, open_secs=10, half_open_probes=2, **kwargs)
+    for _ in range(2):
+        assert breaker.allow(now) == (True, None)
+        breaker.record(False, 0.1, None, now)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_breaker_trips_on_error_rate():
+    breaker = tripped_breaker()
+    assert breaker.allow(1.0) == (False, None)
+    assert breaker.retry_after(1.0) == 9.0
+
+
+def test_breaker_trips_on_slow_calls():
+    breaker = CircuitBreaker(min_calls=2, slow_call_secs=1.0)
+    breaker.record(True, 5.0, None, 0.0)
+    breaker.record(True, 5.0, None, 0.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_probes_close_breaker():
+    breaker = tripped_breaker()
+    _, first = breaker.allow(10.0)
+    _, second = breaker.allow(10.0)
+    assert breaker.state == HALF_OPEN
+    assert first is not None and second is not None
+    assert breaker.allow(10.0) == (False, None)
+    breaker.record(True, 0.1, first, 10.1)
+    assert breaker.state == HALF_OPEN
+    breaker.record(True, 0.1, second, 10.2)
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = tripped_breaker()
+    _, probe = breaker.allow(10.0)
+    breaker.record(False, 0.1, probe, 10.5)
+    assert breaker.state == OPEN
+    assert breaker.opened_at == 10.5
+    assert breaker.probes_in_flight == 0
+
+
+def test_late_probe_from_reopened_window_is_ignored():
+    breaker = tripped_breaker()
+    _, x = breaker.allow(10.0)
+    breaker.record(True, 0.1, x, 10.1)
+    _, a = breaker.allow(10.1)
+    _, b = breaker.allow(10.1)
+    breaker.record(False, 0.1, a, 10.2)
+    assert breaker.state == OPEN
+    breaker.record(True, 0.1, b, 10.3)
+    assert breaker.state == OPEN
+
+    # A probe from the earlier window must not count towards the next one either
+    _, c = breaker.allow(20.3)
+    breaker.record(True, 0.1, b, 20.4)
+    assert breaker.probe_successes == 0
+    breaker.record(True, 0.1, c, 20.5)
+    assert breaker.state == HALF_OPEN
+
+
+def test_adaptive_limit_shrinks_on_errors():
+    limit = AdaptiveLimit(initial=6, max_limit=6)
+    before = limit.limit
+    limit.update(False, 0.1)
+    assert limit.limit < before
+
+
+def test_adaptive_limit_stays_down_under_sustained_slow_calls():
+    limit = AdaptiveLimit(initial=6, max_limit=6)
+    for _ in range(20):
+        limit.update(True, 0.1)
+    assert limit.current == 6
+    seen = []
+    for _ in range(150):
+        limit.update(True, 1.0)
+        seen.append(limit.current)
+    assert seen[20] == 1
+    assert max(seen[20:]) <= 2
+
+
+def test_adaptive_limit_recovers_when_latency_returns():
+    limit = AdaptiveLimit(initial=6, max_limit=6)
+    for latency in [0.1] * 20 + [1.0] * 50:
+        limit.update(True, latency)
+    assert limit.current == 1
+    for _ in range(60):
+        limit.update(True, 0.1)
+    assert limit.current == 6
+
+
+def test_adaptive_limit_tolerates_jitter():
+    limit = AdaptiveLimit(initial=4, max_limit=6)
+    for i in range(200):
+        limit.update(True, (0.2, 0.6, 1.0)[i % 3])
+    assert limit.current >= 5
+
+
+def test_guard_caps_fit_in_worker_pool():
+    per_guard = upstream_guard.MAX_LIMIT + upstream_guard.MAX_QUEUE
+    assert upstream_guard.GUARDS * per_guard <= upstream_guard.WORKER_THREADS // 2
+
+
+def single_slot_guard(**kwargs):
+    return UpstreamGuard("test", limit=AdaptiveLimit(initial=1, max_limit=1), **kwargs)
+
+
+def test_acquire_sheds_when_queue_full():
+    guard = single_slot_guard(max_queue=0)
+    guard.acquire()
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        guard.acquire()
+    assert excinfo.value.reason == "too many pending requests"
+    guard.release()
+    assert guard.stats()["in_flight"] == 0
+
+
+def test_acquire_times_out_in_queue():
+    guard = single_slot_guard(max_queue=1, queue_timeout=0.05)
+    guard.acquire()
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        guard.acquire()
+    assert excinfo.value.reason == "timed out waiting for a slot"
+    assert excinfo.value.retry_after == 1
+    assert guard.stats()["waiting"] == 0
+
+
+def test_queued_call_is_admitted_when_slot_frees():
+    guard = single_slot_guard(max_queue=1, queue_timeout=2.0)
+    guard.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(guard.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    guard.release()
+    waiter.join(timeout=1)
+    assert admitted == [None]
+    assert guard.stats()["in_flight"] == 1
+
+
+def test_acquire_rejects_while_circuit_open():
+    guard = UpstreamGuard("test", breaker=CircuitBreaker(min_calls=1, open_secs=60))
+    with pytest.raises(ValueError):
+        with guard.call():
+            raise ValueError
+    with pytest.raises(UpstreamUnavailable) as excinfo:
+        guard.acquire()
+    assert excinfo.value.reason == "circuit open"
+    assert excinfo.value.retry_after > 1
+
+
+def chunks(*items, error=None):
+    yield from items
+    if error is not None:
+        raise error
+
+
+def test_stream_releases_slot_at_first_chunk():
+    guard = UpstreamGuard("test")
+    stream = guard.stream(chunks(b"a", b"b"))
+    assert guard.stats()["in_flight"] == 0
+    assert len(guard.breaker.window) == 0
+    assert list(stream) == [b"a", b"b"]
+    assert list(guard.breaker.window) == [(True, False)]
+
+
+def test_stream_closed_early_records_nothing():
+    guard = UpstreamGuard("test")
+    stream = guard.stream(chunks(b"a", b"b"))
+    stream.close()
+    stream.close()
+    assert list(stream) == []
+
+    stream = guard.stream(chunks(b"a"))
+    del stream
+    assert guard.stats()["in_flight"] == 0
+    assert len(guard.breaker.window) == 0
+
+
+def test_empty_stream_is_recorded_at_once():
+    guard = UpstreamGuard("test")
+    stream = guard.stream(chunks())
+    assert stream.empty
+    assert list(guard.breaker.window) == [(True, False)]
+    assert list(stream) == []
+    assert len(guard.breaker.window) == 1
+
+
+def test_stream_records_mid_stream_failure():
+    guard = UpstreamGuard("test")
+    stream = guard.stream(chunks(b"a", error=ConnectionError("reset")))
+    assert next(stream) == b"a"
+    with pytest.raises(ConnectionError):
+        next(stream)
+    assert list(guard.breaker.window) == [(False, False)]
+
+
+def test_stream_failure_before_first_chunk_is_recorded():
+    guard = UpstreamGuard("test")
+    with pytest.raises(ConnectionError):
+        guard.stream(chunks(error=ConnectionError("refused")))
+    assert guard.stats()["in_flight"] == 0
+    assert list(guard.breaker.window) == [(False, False)]
+
+
+def test_probe_streams_settle_breaker_at_first_chunk():
+    guard = UpstreamGuard("test", breaker=tripped_breaker(now=time.monotonic() - 20))
+    first = guard.stream(chunks(b"a", b"b"))
+    assert guard.breaker.state == HALF_OPEN
+    assert guard.breaker.probes_in_flight == 0
+    second = guard.stream(chunks(b"c", error=ConnectionError("reset")))
+    assert guard.breaker.state == CLOSED
+    assert guard.stats()["in_flight"] == 0
+
+    # The probes' later stream outcomes are not recorded a second time
+    assert list(first) == [b"a", b"b"]
+    assert next(second) == b"c"
+    with pytest.raises(ConnectionError):
+        next(second)
+    assert len(guard.breaker.window) == 0
@@ -0,0 +1,136 @@
+import sys
+import threading
+from typing import get_args
+
+from schemas.youtube_attributes import genreSchema, moodSchema, instrumentSchema, licenseTypeSchema
+from utils import json_backend
+
+
+class AttributeCodes:
+    """
+    Interns attribute strings as small integer codes. Codes are seeded from
+    the schema enums so they are stable across reloads; values Studio adds
+    later are appended rather than dropped.
+    """
+
+    def __init__(self, known_values):
+        self.values = list(known_values)
+        self.index = {value: i for i, value in enumerate(self.values)}
+
+    def code(self, value: str) -> int:
+        """Returns the code for value, registering it if it is new."""
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.index[value] = code
+        return code
+
+    def mask(self, values) -> int:
+        mask = 0
+        for value in values:
+            mask |= 1 << self.code(value)
+        return mask
+
+    def bit(self, value: str) -> int:
+        """Returns the bit for value, or 0 if it has never been seen."""
+        code = self.index.get(value)
+        return 0 if code is None else 1 << code
+
+
+GENRES = AttributeCodes(get_args(genreSchema))
+MOODS = AttributeCodes(get_args(moodSchema))
+INSTRUMENTS = AttributeCodes(get_args(instrumentSchema))
+LICENSES = AttributeCodes(get_args(licenseTypeSchema))
+
+NO_LICENSE = -1
+
+# Fields split out of each track's JSON into shared, interned fragments
+SHARED_FIELDS = ("licenseType", "attributes")
+_fragments = {}
+_fragments_lock = threading.Lock()
+
+
+def intern_fragment(fragment):
+    """Returns one shared object per distinct encoded fragment (or tuple of fragments)."""
+    with _fragments_lock:
+        return _fragments.setdefault(fragment, fragment)
+
+
+class CompactTrack:
+    """
+    Slim in-memory form of an upstream track. Only the fields we filter on
+    are kept decoded. The JSON is stored as a per-track head plus a tail of
+    interned fragments for licenseType and each attribute list, so the long
+    CREATOR_MUSIC_* strings are stored once per distinct value rather than
+    once per track.
+    """
+
+    __slots__ = ("track_id", "license", "genres", "moods", "instruments", "head", "tail")
+
+    def __init__(self, track_id, license, genres, moods, instruments, head, tail):
+        self.track_id = track_id
+        self.license = license
+        self.genres = genres
+        self.moods = moods
+        self.instruments = instruments
+        self.head = head
+        self.tail = tail
+
+    @classmethod
+    def from_dict(cls, track: dict):
+        track_attributes = track.get("attributes", {})
+        license_type = track.get("licenseType")
+        track_id = track.get("trackId") or track.get("id") or ""
+        head, tail = split_encoded(track)
+        return cls(
+            track_id=sys.intern(track_id),
+            license=LICENSES.code(license_type) if license_type else NO_LICENSE,
+            genres=GENRES.mask(track_attributes.get("genres", [])),
+            moods=MOODS.mask(track_attributes.get("moods", [])),
+            instruments=INSTRUMENTS.mask(track_attributes.get("instruments", [])),
+            head=head,
+            tail=tail,
+        )
+
+    @property
+    def encoded(self) -> bytes:
+        """The track's full JSON object (shared fields come last)."""
+        return self.head + b"".join(self.tail)
+
+
+def split_encoded(track: dict) -> tuple[bytes, tuple]:
+    """
+    Encodes a track as a head and a tuple of interned tail fragments which
+    concatenate to a JSON object. Head ends just before SHARED_FIELDS.
+    """
+    rest = {key: value for key, value in track.items() if key not in SHARED_FIELDS}
+    head = json_backend.dumps(rest)[:-1] if rest else b"{"
+    fragments = []
+    separator = b"," if rest else b""
+    for key in SHARED_FIELDS:
+        if key not in track:
+            continue
+        value = track[key]
+        if key == "attributes" and isinstance(value, dict) and value:
+            fragments.append(separator + b'"attributes":{')
+            for i, (name, values) in enumerate(value.items()):
+                fragments.append((b"," if i else b"") + json_backend.dumps(name) + b":" + json_backend.dumps(values))
+            fragments.append(b"}")
+        else:
+            fragments.append(separator + json_backend.dumps(key) + b":" + json_backend.dumps(value))
+        separator = b","
+    fragments.append(b"}")
+    return head, intern_fragment(tuple(intern_fragment(fragment) for fragment in fragments))
+
+
+def join_tracks(tracks) -> bytes:
+    """Builds a JSON array body from tracks without re-encoding them."""
+    parts = [b"["]
+    for track in tracks:
+        if len(parts) > 1:
+            parts.append(b",")
+        parts.append(track.head)
+        parts.extend(track.tail)
+    parts.append(b"]")
+    return b"".join(parts)
@@ -0,0 +1,31 @@
+import json
+
+# orjson is optional: when installed it is used for both parsing the track
+# database and encoding tracks, otherwise we fall back to the stdlib.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: bytes):
+    # Note: orjson parses integers beyond 64 bits as floats, the stdlib keeps them exact
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """Encodes obj as compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson refuses integers beyond 64 bits; the stdlib encodes them
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def join_array(items) -> bytes:
+    """Builds a JSON array body from already-encoded JSON values."""
+    return b"[" + b",".join(items) + b"]"
@@ -2,7 +2,10 @@ import requests
 import json
 import time
 import os
+import hashlib
+import tempfile
 from dotenv import load_dotenv
+from utils import json_backend
 
 
 
@@ -12,6 +15,7 @@ CHANNEL_ID = os.getenv("CHANNEL_ID")
 # ===== Request URL =====
 CLIENT_SCREEN_NONCE = str(int(time.time()))
 URL = "https://studio.youtube.com/youtubei/v1/creator_music/list_tracks?alt=json"
+OUTPUT_FILE = "youtube_studio_tracks.json"
 
 # ===== Headers =====
 def get_headers(cfg: dict):
@@ -104,67 +108,134 @@ def load_cfg():
         subprocess.run([sys.executable, "utils/token_fetcher.py"], check=True)
         return load_cfg()
 
-def get_all_tracks():
+def default_file_mode() -> int:
+    """Mode a regular open() would give a new file under the current umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+# Read once at import: os.umask can only be queried by setting it
+DEFAULT_FILE_MODE = default_file_mode()
+
+def track_key(tid: str) -> int:
+    """64-bit digest of a trackId; far smaller in a set than the id string itself."""
+    return int.from_bytes(hashlib.blake2b(tid.encode("utf-8"), digest_size=8).digest(), "big")
+
+def open_temp_output(output_file: str):
+    """Creates a temp file next to output_file so the final rename stays on one filesystem."""
+    directory = os.path.dirname(os.path.abspath(output_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(output_file)}.", suffix=".tmp")
+    return os.fdopen(fd, "wb"), tmp_path
+
+def discard_output(f, tmp_path: str):
+    f.close()
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+def commit_output(f, tmp_path: str, output_file: str):
+    """Flushes the temp file to disk and atomically swaps it into place."""
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    # mkstemp creates files as 0600; keep the catalog's existing mode instead
+    try:
+        mode = os.stat(output_file).st_mode & 0o777
+    except FileNotFoundError:
+        mode = DEFAULT_FILE_MODE
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, output_file)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(output_file)), os.O_RDONLY)
+    except OSError:
+        return  # directories can't be opened on every platform (e.g. Windows)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def get_all_tracks(output_file: str = OUTPUT_FILE):
     cfg = load_cfg()
     headers = get_headers(cfg)
     payload = get_payload(cfg)
     all_genres = set()
     all_moods = set()
     all_instruments = set()
-    all_tracks = {}
+    # Tracks are streamed to a temp file page by page; only their keys are kept
+    seen = set()
+    collected = 0
     page = 1
-    while True:
-        print(f"Fetching page {page} ...")
-        resp = requests.post(URL, headers=headers, json=payload, timeout=30)
-        try:
-            resp.raise_for_status()
-        except requests.HTTPError as e:
-            if resp.status_code == 401 or resp.status_code == 403:
-                print(f"{resp.status_code} Unauthorized — refreshing tokens...")
-                import subprocess, sys
-                subprocess.run([sys.executable, "utils/token_fetcher.py"], check=True)
-                cfg = load_cfg()
-                headers = get_headers(cfg)
-                payload = get_payload(cfg)
-                continue
-            else:
-                print("HTTP error:", e, resp.status_code, resp.text[:400])
-                break
+    error = None
+    f, tmp_path = open_temp_output(output_file)
+    try:
+        f.write(b'{"tracks": [\n')
+        while True:
+            print(f"Fetching page {page} ...")
+            resp = requests.post(URL, headers=headers, json=payload, timeout=30)
+            try:
+                resp.raise_for_status()
+            except requests.HTTPError as e:
+                if resp.status_code == 401 or resp.status_code == 403:
+                    print(f"{resp.status_code} Unauthorized — refreshing tokens...")
+                    import subprocess, sys
+                    subprocess.run([sys.executable, "utils/token_fetcher.py"], check=True)
+                    cfg = load_cfg()
+                    headers = get_headers(cfg)
+                    payload = get_payload(cfg)
+                    continue
+                else:
+                    print("HTTP error:", e, resp.status_code, resp.text[:400])
+                    error = f"HTTP {resp.status_code} while fetching page {page}; existing track database kept."
+                    break
 
-        data = resp.json()
-        tracks = data.get("tracks", [])
-        if not tracks and "pageInfo" in data and data["pageInfo"].get("totalSizeInfo"):
+            data = resp.json()
             tracks = data.get("tracks", [])
+            if not tracks and "pageInfo" in data and data["pageInfo"].get("totalSizeInfo"):
+                tracks = data.get("tracks", [])
 
-        for t in tracks:
-            all_genres.update(t.get("attributes", {}).get("genres", []))
-            all_moods.update(t.get("attributes", {}).get("moods", []))
-            all_instruments.update(t.get("attributes", {}).get("instruments", []))
-            tid = t.get("trackId") or t.get("id")
-            if tid:
-                all_tracks[tid] = t
+            for t in tracks:
+                all_genres.update(t.get("attributes", {}).get("genres", []))
+                all_moods.update(t.get("attributes", {}).get("moods", []))
+                all_instruments.update(t.get("attributes", {}).get("instruments", []))
+                tid = t.get("trackId") or t.get("id")
+                if not tid:
+                    continue
+                key = track_key(tid)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if collected:
+                    f.write(b",\n")
+                f.write(json_backend.dumps(t))
+                collected += 1
 
-        # get next page token (matches your response: pageInfo.nextPageToken)
-        next_token = data.get("pageInfo", {}).get("nextPageToken")
-        if not next_token:
-            print("No nextPageToken — done.")
-            break
+            # get next page token (matches your response: pageInfo.nextPageToken)
+            next_token = data.get("pageInfo", {}).get("nextPageToken")
+            if not next_token:
+                print("No nextPageToken — done.")
+                break
 
-        # set token for next request inside pageInfo
-        payload.setdefault("pageInfo", {})["pageToken"] = next_token
-        page += 1
-        time.sleep(0.8)  # polite delay
+            # set token for next request inside pageInfo
+            payload.setdefault("pageInfo", {})["pageToken"] = next_token
+            page += 1
+            time.sleep(0.8)  # polite delay
 
-    print(f"Collected tracks: {len(all_tracks)}")
+        if error:
+            # A partial scrape must never replace the existing catalog
+            discard_output(f, tmp_path)
+            return {"success": False, "error": error}
 
-    output_file ="youtube_studio_tracks.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump({"collected": len(all_tracks), "tracks": list(all_tracks.values())}, f, ensure_ascii=False, indent=2)
+        f.write(f'\n], "collected": {collected}}}\n'.encode("utf-8"))
+        commit_output(f, tmp_path, output_file)
+    except BaseException:
+        # Leave the existing catalog untouched if anything goes wrong mid-scrape
+        discard_output(f, tmp_path)
+        raise
 
+    print(f"Collected tracks: {collected}")
     print(f"Saved to {output_file}")
     return {
         "success": True, 
-        "count": len(all_tracks),
+        "count": collected,
         "available_attributes": {
             "genres": list(all_genres),
             "moods": list(all_moods),
@@ -0,0 +1,291 @@
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+from utils.track_downloader import get_download_url_for_track, open_track_stream
+from utils.upstream_guard import UpstreamUnavailable
+
+# ====== Defaults ======
+HALF_LIFE_SECS = 6 * 60 * 60
+MAX_TRACKED = 10000
+PREFETCH_TOP_N = 20
+PREFETCH_INTERVAL_SECS = 60
+URL_DEFAULT_TTL_SECS = 30 * 60
+URL_REFRESH_MARGIN_SECS = 10 * 60
+AUDIO_CACHE_MAX_BYTES = 256 * 1024 * 1024
+AUDIO_MAX_TRACK_BYTES = 32 * 1024 * 1024
+
+
+class DecayingCounter:
+    """
+    Per-track request counter whose weights halve every half_life seconds.
+    Hits are stored pre-scaled by exp(rate * t) so recording one is O(1)
+    and decay is only applied when scores are read.
+    """
+
+    def __init__(self, half_life=HALF_LIFE_SECS, max_tracked=MAX_TRACKED):
+        self.rate = math.log(2) / half_life
+        self.max_tracked = max_tracked
+        self.origin = time.monotonic()
+        self.scores = {}
+        self._lock = threading.Lock()
+
+    def hit(self, track_id: str, weight: float = 1.0):
+        with self._lock:
+            now = time.monotonic()
+            exponent = self.rate * (now - self.origin)
+            if exponent > 50:
+                self._rebase(now)
+                exponent = 0.0
+            self.scores[track_id] = self.scores.get(track_id, 0.0) + weight * math.exp(exponent)
+            if len(self.scores) > self.max_tracked:
+                keep = heapq.nlargest(self.max_tracked // 2, self.scores.items(), key=lambda item: item[1])
+                self.scores = dict(keep)
+
+    def forget(self, track_id: str):
+        with self._lock:
+            self.scores.pop(track_id, None)
+
+    def _rebase(self, now: float):
+        factor = math.exp(-self.rate * (now - self.origin))
+        self.scores = {tid: score * factor for tid, score in self.scores.items()}
+        self.origin = now
+
+    def top(self, n: int) -> list[tuple[str, float]]:
+        """Returns the n most requested tracks with their current decayed scores."""
+        with self._lock:
+            factor = math.exp(-self.rate * (time.monotonic() - self.origin))
+            best = heapq.nlargest(n, self.scores.items(), key=lambda item: item[1])
+        return [(tid, score * factor) for tid, score in best]
+
+
+def url_expiry(url: str, now: float) -> float:
+    """Wall-clock expiry of a signed download URL, from its `expire` parameter if present."""
+    expire = parse_qs(urlparse(url).query).get("expire")
+    if expire:
+        try:
+            return float(expire[0])
+        except ValueError:
+            pass
+    return now + URL_DEFAULT_TTL_SECS
+
+
+class SignedUrlCache:
+    """Resolved (title, download URL) pairs, dropped shortly before the URL expires."""
+
+    def __init__(self, refresh_margin=URL_REFRESH_MARGIN_SECS):
+        self.refresh_margin = refresh_margin
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def put(self, track_id: str, title: str, url: str):
+        now = time.time()
+        with self._lock:
+            self.entries[track_id] = (title, url, url_expiry(url, now))
+
+    def get(self, track_id: str):
+        with self._lock:
+            entry = self.entries.get(track_id)
+        if entry is None or entry[2] - self.refresh_margin <= time.time():
+            return None
+        return entry[0], entry[1]
+
+    def discard(self, track_id: str):
+        with self._lock:
+            self.entries.pop(track_id, None)
+
+    def needs_refresh(self, track_id: str) -> bool:
+        return self.get(track_id) is None
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            self.entries = {tid: e for tid, e in self.entries.items() if e[2] > now}
+
+
+class AudioCache:
+    """LRU of fully downloaded audio, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, track_id: str, filename: str, download_url: str, data: bytes):
+        with self._lock:
+            self._pop(track_id)
+            self.entries[track_id] = (filename, download_url, data)
+            self.size += len(data)
+            while self.size > self.max_bytes and self.entries:
+                self._pop(next(iter(self.entries)))
+
+    def get(self, track_id: str):
+        with self._lock:
+            entry = self.entries.get(track_id)
+            if entry is not None:
+                self.entries.move_to_end(track_id)
+            return entry
+
+    def discard(self, track_id: str):
+        with self._lock:
+            self._pop(track_id)
+
+    def retain(self, track_ids):
+        """Evicts everything not in track_ids."""
+        with self._lock:
+            for tid in [tid for tid in self.entries if tid not in track_ids]:
+                self._pop(tid)
+
+    def _pop(self, track_id: str):
+        entry = self.entries.pop(track_id, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def __contains__(self, track_id: str):
+        with self._lock:
+            return track_id in self.entries
+
+
+def read_audio(url: str, max_bytes: int = AUDIO_MAX_TRACK_BYTES):
+    """Downloads a whole track into memory, or returns None if it is larger than max_bytes."""
+    chunks = open_track_stream(url)
+    data = bytearray()
+    try:
+        for chunk in chunks:
+            data += chunk
+            if len(data) > max_bytes:
+                return None
+    finally:
+        chunks.close()
+    return bytes(data)
+
+
+class Prefetcher:
+    """
+    Background worker that keeps signed URLs (and optionally audio) warm for
+    the most requested tracks, resolving all stale URLs in one get_tracks call.
+    """
+
+    def __init__(self, top_n=PREFETCH_TOP_N, interval=PREFETCH_INTERVAL_SECS, prefetch_audio=False):
+        self.top_n = top_n
+        self.interval = interval
+        self.prefetch_audio = prefetch_audio
+        self.popularity = DecayingCounter()
+        self.urls = SignedUrlCache()
+        self.audio = AudioCache()
+        # Hot tracks whose audio is over AUDIO_MAX_TRACK_BYTES, so it isn't re-downloaded every cycle
+        self.too_large = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="track-prefetcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.prefetch()
+            except Exception as e:
+                print("Prefetch failed:", str(e))
+
+    def forget(self, track_id: str):
+        """Drops cached URL and audio for a track, e.g. after its URL was rejected."""
+        self.urls.discard(track_id)
+        self.audio.discard(track_id)
+
+    def resolve_urls(self, track_ids: list[str]):
+        """
+        Resolves URLs for track_ids in one batched call. If the batch fails,
+        falls back to one call per track so a single bad ID can't block the
+        rest. IDs Studio doesn't know are dropped from the popularity ranking.
+        """
+        try:
+            resolved = get_download_url_for_track(track_ids, skip_missing=True)
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            print("Batched URL prefetch failed, resolving tracks one by one:", str(e))
+            resolved = {}
+            for tid in track_ids:
+                try:
+                    result = get_download_url_for_track([tid], skip_missing=True)
+                except requests.HTTPError as err:
+                    # Only a client error says something about this ID; 5xx is Studio's problem
+                    if err.response is None or err.response.status_code >= 500:
+                        raise
+                    continue
+                except RuntimeError:
+                    continue
+                if result is None:
+                    return  # tokens could not be refreshed; try again next cycle
+                resolved.update(result)
+        if resolved is None:
+            return  # tokens could not be refreshed; try again next cycle
+
+        for tid in track_ids:
+            if tid in resolved:
+                self.urls.put(tid, *resolved[tid])
+            else:
+                print(f"Dropping {tid} from prefetch: no download URL returned.")
+                self.popularity.forget(tid)
+
+    def prefetch(self):
+        hot = [tid for tid, _ in self.popularity.top(self.top_n)]
+        self.urls.prune()
+        stale = [tid for tid in hot if self.urls.needs_refresh(tid)]
+        if stale:
+            self.resolve_urls(stale)
+
+        if not self.prefetch_audio:
+            return
+        self.audio.retain(set(hot))
+        self.too_large &= set(hot)
+        for tid in hot:
+            if self._stop.is_set():
+                return
+            entry = self.urls.get(tid)
+            if entry is None or tid in self.audio or tid in self.too_large:
+                continue
+            title, url = entry
+            try:
+                data = read_audio(url)
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                # Most likely a revoked URL; resolve it again next cycle and go on with the rest
+                print(f"Audio prefetch for {tid} failed:", str(e))
+                self.forget(tid)
+                continue
+            if data is None:
+                self.too_large.add(tid)
+            elif not data:
+                self.forget(tid)
+            else:
+                self.audio.put(tid, title, url, data)
+
+    def ranking(self, n: int) -> list[dict]:
+        return [
+            {
+                "trackId": tid,
+                "score": round(score, 4),
+                "urlCached": self.urls.get(tid) is not None,
+                "audioCached": tid in self.audio,
+            }
+            for tid, score in self.popularity.top(n)
+        ]
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+SEARCH_CACHE_SIZE = 256
+# Entries are whole encoded response bodies, so memory is bounded by bytes
+# as well as by count. Broad queries can be nearly the size of the catalog;
+# bodies over SEARCH_CACHE_MAX_ENTRY_BYTES are not cached at all.
+SEARCH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SEARCH_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+
+def normalize_search_key(genre, mood, instrument, license_type, use_or_logic):
+    """
+    Reduces a search request to a hashable tuple so that equivalent
+    request bodies (e.g. use_or_logic None vs False) share a cache entry.
+    """
+    return (genre, mood, instrument, license_type or None, bool(use_or_logic))
+
+
+def make_etag(catalog_version: str, key: tuple) -> str:
+    """Strong ETag derived from the catalog version and the normalized query."""
+    digest = hashlib.sha1(repr((catalog_version, key)).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Checks an If-None-Match header value against an ETag (RFC 9110 weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class SearchCache:
+    """
+    Bounded LRU cache of encoded search results for a single catalog version.
+    Whenever a lookup or store is made against a different catalog version
+    the whole cache is dropped, so stale results are never served.
+    """
+
+    def __init__(self, maxsize: int = SEARCH_CACHE_SIZE, max_bytes: int = SEARCH_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = SEARCH_CACHE_MAX_ENTRY_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.version = None
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.size = 0
+            self.version = version
+
+    def _pop(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+
+    def get(self, version, key):
+        with self._lock:
+            self._sync_version(version)
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, version, key, value: bytes):
+        with self._lock:
+            self._sync_version(version)
+            self._pop(key)
+            if len(value) > self.max_entry_bytes:
+                return
+            self._entries[key] = value
+            self.size += len(value)
+            while len(self._entries) > self.maxsize or self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.version = None
@@ -0,0 +1,62 @@
+import numpy as np
+
+from utils.compact_tracks import CompactTrack, GENRES, MOODS, INSTRUMENTS
+
+ATTRIBUTE_FIELDS = (("genres", GENRES), ("moods", MOODS), ("instruments", INSTRUMENTS))
+
+
+class SimilarityIndex:
+    """
+    Dense track x attribute 0/1 matrix over genres, moods and instruments,
+    built once per catalog version so a similarity query is a single
+    matrix-vector product over the whole library.
+    """
+
+    def __init__(self, tracks: list[CompactTrack]):
+        self.position = {track.track_id: i for i, track in enumerate(tracks)}
+        self.licenses = np.fromiter((track.license for track in tracks), dtype=np.int32, count=len(tracks))
+        columns = []
+        for field, codes in ATTRIBUTE_FIELDS:
+            masks = [getattr(track, field) for track in tracks]
+            for bit in range(len(codes.values)):
+                columns.append(np.fromiter(((mask >> bit) & 1 for mask in masks), dtype=np.float32, count=len(tracks)))
+        if columns:
+            self.matrix = np.stack(columns, axis=1)
+        else:
+            self.matrix = np.zeros((len(tracks), 0), dtype=np.float32)
+        # Rows are binary, so the attribute count doubles as the squared L2 norm
+        self.row_sizes = self.matrix.sum(axis=1)
+        self.row_norms = np.sqrt(self.row_sizes)
+
+    def rows_for(self, track_ids: list[str]) -> list[int]:
+        return [self.position[tid] for tid in dict.fromkeys(track_ids) if tid in self.position]
+
+    def top_k(self, rows: list[int], k: int, metric: str = "jaccard", license_code: int | None = None):
+        """
+        Scores every track against the seed rows and returns up to k
+        (row, score) pairs, best first. Jaccard compares against the union of
+        the seeds' attributes; cosine compares against their mean vector.
+        Seeds themselves and tracks with no overlap are never returned.
+        """
+        seeds = self.matrix[rows]
+        scores = np.zeros(len(self.matrix), dtype=np.float32)
+        if metric == "cosine":
+            query = seeds.mean(axis=0)
+            denominator = self.row_norms * np.linalg.norm(query)
+            np.divide(self.matrix @ query, denominator, out=scores, where=denominator > 0)
+        else:
+            query = seeds.max(axis=0)
+            intersection = self.matrix @ query
+            union = self.row_sizes + query.sum() - intersection
+            np.divide(intersection, union, out=scores, where=union > 0)
+
+        scores[rows] = 0
+        if license_code is not None:
+            scores[self.licenses != license_code] = 0
+
+        k = min(k, int(np.count_nonzero(scores > 0)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(i), float(scores[i])) for i in top]
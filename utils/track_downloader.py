@@ -6,6 +6,7 @@ import json
 from urllib.parse import urlparse, parse_qs
 import os
 from dotenv import load_dotenv
+from utils.upstream_guard import studio_guard, media_guard
 load_dotenv()
 
 # ====== Endpoints ======
@@ -135,12 +136,19 @@ def sanitize_filename(name: str):
     return name[:200] 
 
 # ====== Function: ask Studio for download URL for a trackId ======
-def get_download_url_for_track(track_ids: list[str], max_retries: int = 2):
+def get_download_url_for_track(track_ids: list[str], max_retries: int = 2, skip_missing: bool = False):
+    """
+    Returns {trackId: (title, download URL)}. With skip_missing, tracks that
+    Studio doesn't return or returns without a URL are left out instead of
+    failing the whole batch.
+    """
     for _ in range(max_retries):
         cfg = load_cfg()
         studio_headers = get_studio_headers(cfg)
         payload = get_studio_payload(cfg, track_ids)
-        resp = requests.post(GET_TRACKS_URL, headers=studio_headers, json=payload, timeout=REQUEST_TIMEOUT)
+        with studio_guard.call() as outcome:
+            resp = requests.post(GET_TRACKS_URL, headers=studio_headers, json=payload, timeout=REQUEST_TIMEOUT)
+            outcome.ok = resp.status_code < 500
         try:
             resp.raise_for_status()
         except requests.HTTPError as e:
@@ -155,12 +163,16 @@ def get_download_url_for_track(track_ids: list[str], max_retries: int = 2):
         data = resp.json()
         tracks = data.get("tracks", [])
         if not tracks:
+            if skip_missing:
+                return {}
             raise RuntimeError("No track object returned in get_tracks response.")
         track_urls = {}
         for track_obj in tracks:
             dl_url = track_obj.get("downloadAudioUrl")
             dl_title = track_obj.get("title")
             if not dl_url:
+                if skip_missing:
+                    continue
                 raise RuntimeError("downloadAudioUrl not present in response. Check permissions/tokens.")
             track_urls[track_obj.get("trackId")] = (dl_title, dl_url)
         return track_urls
@@ -224,6 +236,15 @@ def stream_track_from_url(url: str, chunk_size=8192, max_retries: int = 2):
                 if chunk:
                     yield chunk
         break
+# ====== Function: open a guarded stream, failing fast if the host is unhealthy ======
+def open_track_stream(url: str, chunk_size=8192):
+    """
+    Connects to the download host and reads the first chunk before returning,
+    so an overloaded or failing upstream raises UpstreamUnavailable here
+    instead of after the client response has started.
+    """
+    return media_guard.stream(stream_track_from_url(url, chunk_size=chunk_size))
+
 # ====== Example usage: download a single track by id ======
 if __name__ == "__main__":
     json_data = json.load(open("youtube_studio_tracks.json", "r", encoding="utf-8"))
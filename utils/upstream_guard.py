@@ -0,0 +1,354 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# ====== Defaults ======
+# Sync endpoints (search included) share Starlette's worker pool. A download
+# request blocks a worker inside one of the guards only until the upstream
+# sends its first chunk; the rest of the body is pulled one chunk per worker
+# call, outside the guards. So the guards together can pin at most
+# GUARDS * (MAX_LIMIT + MAX_QUEUE) workers. Keep that at or below half the
+# pool so in-memory endpoints always have workers left, however slow the
+# upstreams get.
+WORKER_THREADS = 40  # anyio's default thread limiter
+GUARDS = 2  # studio_guard and media_guard below
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 6
+LATENCY_TOLERANCE = 2.0
+QUEUE_ALLOWANCE = 0.5
+BASELINE_DRIFT = 0.002
+MAX_QUEUE = 4
+QUEUE_TIMEOUT = 2.0
+
+WINDOW_SIZE = 50
+MIN_CALLS = 10
+ERROR_RATE_THRESHOLD = 0.5
+SLOW_CALL_SECS = 10.0
+SLOW_RATE_THRESHOLD = 0.5
+OPEN_SECS = 30.0
+HALF_OPEN_PROBES = 2
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call is shed before reaching the upstream."""
+
+    def __init__(self, upstream: str, reason: str, retry_after: float):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class CircuitBreaker:
+    """
+    Trips open when the error rate or the share of slow calls over the last
+    WINDOW_SIZE calls crosses its threshold. After OPEN_SECS a few half-open
+    probes are let through; if they all succeed the breaker closes again.
+    """
+
+    def __init__(self, window_size=WINDOW_SIZE, min_calls=MIN_CALLS,
+                 error_rate=ERROR_RATE_THRESHOLD, slow_call_secs=SLOW_CALL_SECS,
+                 slow_rate=SLOW_RATE_THRESHOLD, open_secs=OPEN_SECS,
+                 half_open_probes=HALF_OPEN_PROBES):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_secs = slow_call_secs
+        self.slow_rate = slow_rate
+        self.open_secs = open_secs
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        # Each half-open window gets a new generation; probe results from
+        # an earlier window are ignored
+        self.generation = 0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.window = deque(maxlen=window_size)
+
+    def allow(self, now: float):
+        """
+        Returns (allowed, probe). probe is the half-open generation the call
+        belongs to, or None for a normal call. Caller must hold the guard lock.
+        """
+        if self.state == OPEN:
+            if now - self.opened_at < self.open_secs:
+                return False, None
+            self.state = HALF_OPEN
+            self.generation += 1
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                return False, None
+            self.probes_in_flight += 1
+            return True, self.generation
+        return True, None
+
+    def retry_after(self, now: float) -> float:
+        if self.state == OPEN:
+            return self.opened_at + self.open_secs - now
+        return 1.0
+
+    def _is_current_probe(self, probe) -> bool:
+        return probe is not None and self.state == HALF_OPEN and probe == self.generation
+
+    def cancel_probe(self, probe):
+        """Gives back a probe slot for a call that never produced an outcome."""
+        if self._is_current_probe(probe):
+            self.probes_in_flight -= 1
+
+    def record(self, ok: bool, latency: float, probe, now: float):
+        slow = latency >= self.slow_call_secs
+        if probe is not None:
+            if not self._is_current_probe(probe):
+                return
+            self.probes_in_flight -= 1
+            if not ok or slow:
+                self._trip(now)
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= self.half_open_probes:
+                self.state = CLOSED
+                self.window.clear()
+            return
+        if self.state != CLOSED:
+            return
+        self.window.append((ok, slow))
+        if len(self.window) < self.min_calls:
+            return
+        errors = sum(1 for call_ok, _ in self.window if not call_ok)
+        slow_calls = sum(1 for _, call_slow in self.window if call_slow)
+        if errors / len(self.window) >= self.error_rate or slow_calls / len(self.window) >= self.slow_rate:
+            self._trip(now)
+
+    def _trip(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.window.clear()
+
+
+class AdaptiveLimit:
+    """
+    Gradient-style concurrency limit. Keeps a baseline latency that follows
+    drops at once but rises only by BASELINE_DRIFT per call, so a sustained
+    slowdown doesn't become the new normal within a few calls. While recent
+    latency stays within `tolerance` times the baseline the limit grows by
+    a small queue allowance; beyond that it shrinks in proportion.
+    """
+
+    def __init__(self, initial=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT, smoothing=0.2,
+                 tolerance=LATENCY_TOLERANCE, queue_allowance=QUEUE_ALLOWANCE, baseline_drift=BASELINE_DRIFT):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.queue_allowance = queue_allowance
+        self.baseline_drift = baseline_drift
+        self.short_rtt = None
+        self.baseline_rtt = None
+
+    def update(self, ok: bool, latency: float):
+        if not ok:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+            return
+        if self.short_rtt is None:
+            self.short_rtt = self.baseline_rtt = latency
+        else:
+            self.short_rtt = 0.5 * self.short_rtt + 0.5 * latency
+            if self.short_rtt < self.baseline_rtt:
+                self.baseline_rtt = self.short_rtt
+            else:
+                self.baseline_rtt += self.baseline_drift * (self.short_rtt - self.baseline_rtt)
+        if self.short_rtt > 0:
+            gradient = max(0.5, min(1.0, self.tolerance * self.baseline_rtt / self.short_rtt))
+        else:
+            gradient = 1.0
+        new_limit = self.limit * gradient + self.queue_allowance
+        new_limit = self.limit * (1 - self.smoothing) + new_limit * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, new_limit))
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+
+class CallOutcome:
+    """Handed to the body of UpstreamGuard.call() to report HTTP-level failures."""
+
+    __slots__ = ("ok",)
+
+    def __init__(self):
+        self.ok = True
+
+
+class GuardedStream:
+    """
+    Iterator over an upstream stream admitted by UpstreamGuard.stream, which
+    has already given back the guard slot. Unless it was settled at the
+    first chunk, the outcome is recorded when the stream finishes: success
+    on exhaustion, failure if the upstream raises mid-stream (read timeouts,
+    dropped connections). Latency is the time to the first chunk, so long
+    downloads don't count as slow calls. Closing early records nothing.
+    """
+
+    def __init__(self, guard: "UpstreamGuard", first, chunks, latency: float, settled: bool):
+        self._guard = guard
+        self._first = first
+        self._chunks = chunks
+        # True if the upstream ended without producing any data
+        self.empty = first is None
+        self._latency = latency
+        # An empty stream is already exhausted, and UpstreamGuard.stream recorded it
+        self._closed = self.empty
+        self._settled = settled
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            chunk, self._first = self._first, None
+            return chunk
+        if self._closed:
+            raise StopIteration
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self._finish(True)
+            raise
+        except BaseException:
+            self._finish(False)
+            raise
+
+    def _finish(self, ok):
+        if self._closed:
+            return
+        self._closed = True
+        self._first = None
+        self._chunks.close()
+        if ok is not None and not self._settled:
+            self._guard.record(ok, self._latency, None)
+
+    def close(self):
+        self._finish(None)
+
+    def __del__(self):
+        self.close()
+
+
+class UpstreamGuard:
+    """
+    Per-upstream admission control: a circuit breaker in front of an
+    adaptive concurrency limiter with a bounded wait queue. Calls that
+    cannot be admitted raise UpstreamUnavailable instead of blocking.
+    """
+
+    def __init__(self, name: str, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT,
+                 breaker: CircuitBreaker | None = None, limit: AdaptiveLimit | None = None):
+        self.name = name
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.limit = limit or AdaptiveLimit()
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Takes a concurrency slot. Returns the probe generation, or None for a normal call."""
+        with self._cond:
+            now = time.monotonic()
+            allowed, probe = self.breaker.allow(now)
+            if not allowed:
+                raise UpstreamUnavailable(self.name, "circuit open", self.breaker.retry_after(now))
+            if self.in_flight >= self.limit.current:
+                if self.waiting >= self.max_queue:
+                    self.breaker.cancel_probe(probe)
+                    raise UpstreamUnavailable(self.name, "too many pending requests", self.queue_timeout)
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(
+                        lambda: self.in_flight < self.limit.current, timeout=self.queue_timeout
+                    )
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.breaker.cancel_probe(probe)
+                    raise UpstreamUnavailable(self.name, "timed out waiting for a slot", self.queue_timeout)
+            self.in_flight += 1
+            return probe
+
+    def record(self, ok: bool, latency: float, probe):
+        """Feeds a call's outcome to the breaker and the adaptive limit."""
+        with self._cond:
+            self.breaker.record(ok, latency, probe, time.monotonic())
+            self.limit.update(ok, latency)
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def call(self):
+        """
+        Guards a single blocking upstream call. Exceptions count as failures;
+        the body can also set `outcome.ok = False` for e.g. 5xx responses.
+        """
+        probe = self.acquire()
+        outcome = CallOutcome()
+        start = time.monotonic()
+        try:
+            yield outcome
+        except Exception:
+            outcome.ok = False
+            raise
+        finally:
+            self.record(outcome.ok, time.monotonic() - start, probe)
+            self.release()
+
+    def stream(self, chunks):
+        """
+        Pulls the first chunk of an upstream stream under the guard, so that
+        shedding and connection errors surface before a response is started.
+        The slot is released as soon as the first chunk arrives: it bounds
+        concurrent connection attempts, not downloads in progress.
+        """
+        probe = self.acquire()
+        start = time.monotonic()
+        try:
+            first = next(chunks, None)
+        except Exception:
+            self.record(False, time.monotonic() - start, probe)
+            raise
+        finally:
+            self.release()
+        latency = time.monotonic() - start
+        # A half-open probe is settled by the first chunk, so the breaker
+        # doesn't wait for a whole download before closing
+        settled = probe is not None or first is None
+        if settled:
+            self.record(True, latency, probe)
+        return GuardedStream(self, first, chunks, latency, settled)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "state": self.breaker.state,
+                "limit": self.limit.current,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+            }
+
+
+studio_guard = UpstreamGuard("YouTube Studio")
+media_guard = UpstreamGuard("audio download host")